@@ -4,6 +4,7 @@ import json
 import logging
 import os
 from prometheus_client import Gauge, start_http_server
+from trace_profiler import TraceProfiler, counter, span
 
 # Configure logging
 logging.basicConfig(
@@ -25,6 +26,15 @@ video_generation_duration = Gauge('video_generation_duration_seconds', 'Time tak
 # Constants
 VIDEO_OUTPUT_DIR = '/workspace/data/videos'
 WAN_OUTPUT_DIR = '/workspace/'
+TRACE_DIR = '/workspace/data/traces'
+GENERATION_TASK = 't2v-14B'
+GENERATION_SIZE = '832*480'
+
+# Profiling: set PROFILE_JOBS=N to write Chrome/Perfetto traces of the first
+# N tests to TRACE_DIR. generate.py runs in a subprocess, so the trace covers
+# this runner's view of each test (subprocess lifetime, it/s, file I/O).
+profiler = TraceProfiler(TRACE_DIR, use_torch=False)
+profiler.arm(int(os.environ.get('PROFILE_JOBS', '0')))
 
 
 # Test prompts
@@ -42,6 +52,7 @@ def parse_output_metrics(output_line):
         if "it/s" in output_line:
             speed = float(output_line.split("it/s")[0].split()[-1])
             iterations_per_second.set(speed)
+            counter("iterations_per_second", value=speed)
             logging.debug(f"Current speed: {speed} it/s")
     except ValueError as e:
         logging.warning(f"Failed to parse metrics from line: {output_line}, error: {e}")
@@ -57,8 +68,8 @@ def run_video_generation(prompt, test_number):
     cmd = [
         "python",
         "/workspace/Wan2.1/generate.py",
-        "--task", "t2v-14B",
-        "--size", "832*480",
+        "--task", GENERATION_TASK,
+        "--size", GENERATION_SIZE,
         "--ckpt_dir", "/workspace/Wan2.1/Wan2.1-T2V-14B",
         "--prompt", prompt,
         "--save_file", save_file_path
@@ -66,30 +77,31 @@ def run_video_generation(prompt, test_number):
     
     start_time = time.time()
     try:
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            bufsize=1  # Line buffered
-        )
-        
-        # Monitor process output
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-            if output:
-                parse_output_metrics(output)
-                logging.info(output.strip())
-        
-        # Check for errors
-        stderr = process.stderr.read()
-        if stderr:
-            logging.error(f"Error in test {test_number}: {stderr}")
-        
-        # Wait for process to complete
-        return_code = process.wait()
+        with span("generate.py", task=GENERATION_TASK, size=GENERATION_SIZE):
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+                bufsize=1  # Line buffered
+            )
+            
+            # Monitor process output
+            while True:
+                output = process.stdout.readline()
+                if output == '' and process.poll() is not None:
+                    break
+                if output:
+                    parse_output_metrics(output)
+                    logging.info(output.strip())
+            
+            # Check for errors
+            stderr = process.stderr.read()
+            if stderr:
+                logging.error(f"Error in test {test_number}: {stderr}")
+            
+            # Wait for process to complete
+            return_code = process.wait()
         end_time = time.time()
         duration = end_time - start_time
         video_generation_duration.set(duration)
@@ -99,9 +111,12 @@ def run_video_generation(prompt, test_number):
             logging.info(f"Generation time: {duration:.2f} seconds")
             
             # Check if video file was created at the specified path
-            if os.path.exists(save_file_path):
+            with span("file_io", path=save_file_path):
+                video_exists = os.path.exists(save_file_path)
+                if video_exists:
+                    file_size = os.path.getsize(save_file_path) / (1024 * 1024)  # Convert to MB
+            if video_exists:
                 logging.info(f"Video available at: {save_file_path}")
-                file_size = os.path.getsize(save_file_path) / (1024 * 1024)  # Convert to MB
                 logging.info(f"Video size: {file_size:.2f} MB")
             else:
                 logging.error(f"Video file {save_file_path} NOT found after generation for test {test_number}, though script exited with 0.")
@@ -119,7 +134,7 @@ def save_test_results(results):
     """Save test results to JSON file"""
     try:
         results_file = '/workspace/data/logs/test_results.json'
-        with open(results_file, 'w') as f:
+        with span("file_io", path=results_file), open(results_file, 'w') as f:
             json.dump(results, f, indent=2)
         logging.info(f"Test results saved to: {results_file}")
     except Exception as e:
@@ -138,7 +153,8 @@ def run_test_sequence():
         current_test_number.set(i)
         
         start_time = time.time()
-        exit_code = run_video_generation(prompt, i)
+        with profiler.job(f"test_{i}", prompt=prompt):
+            exit_code = run_video_generation(prompt, i)
         end_time = time.time()
         
         result = {
@@ -0,0 +1,149 @@
+# Lazily loaded, idle-evicting wrapper around a prompt expander.
+#
+# Kept free of torch/wan imports so it can be exercised with stub factories;
+# the Gradio server injects the real expander factory.
+import gc
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LazyPromptExpander:
+    """
+    Builds the prompt expander on first use and releases it once idle.
+
+    Loading runs on a background worker so concurrent first-use requests
+    share a single load. After `idle_timeout` seconds without a request the
+    expander is either dropped entirely (`offload="unload"`) or its model is
+    moved to host memory (`offload="cpu"`).
+    """
+
+    def __init__(self, factory, device=0, idle_timeout=300, offload="unload"):
+        self._factory = factory
+        self.device = device
+        self.idle_timeout = idle_timeout
+        self.offload = offload
+        self._expander = None
+        self._on_cpu = False
+        self._pending = None
+        self._active = 0
+        self._timer = None
+        self._timer_token = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="prompt_expander")
+        self.stats = {
+            "loads": 0,
+            "restores": 0,
+            "unloads": 0,
+            "cold_requests": 0,
+            "cold_latency_s": [],
+        }
+
+    def __call__(self, prompt, *args, **kwargs):
+        start = time.perf_counter()
+        with self._lock:
+            self._cancel_timer()
+            self._active += 1
+            cold = self._expander is None or self._on_cpu
+            if self._expander is None and self._pending is None:
+                self._pending = self._executor.submit(self._load)
+            pending = self._pending
+        try:
+            if pending is not None:
+                pending.result()
+            with self._lock:
+                if self._on_cpu:
+                    self._move_model(self.device)
+                    self._on_cpu = False
+                    self.stats["restores"] += 1
+                    print(
+                        f"[prompt_expander] restored to {self.device}",
+                        flush=True)
+                expander = self._expander
+            output = expander(prompt, *args, **kwargs)
+        finally:
+            with self._lock:
+                self._active -= 1
+                if self._active == 0:
+                    self._schedule_eviction()
+
+        if cold:
+            latency = time.perf_counter() - start
+            with self._lock:
+                self.stats["cold_requests"] += 1
+                self.stats["cold_latency_s"].append(latency)
+            print(
+                f"[prompt_expander] cold request served in {latency:.2f}s",
+                flush=True)
+        return output
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            expander = self._factory()
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            self._expander = expander
+            self._on_cpu = False
+            self._pending = None
+            self.stats["loads"] += 1
+        print(
+            f"[prompt_expander] loaded in {time.perf_counter() - start:.2f}s",
+            flush=True)
+
+    def _schedule_eviction(self):
+        if not self.idle_timeout or self._expander is None or self._on_cpu:
+            return
+        self._timer_token += 1
+        self._timer = threading.Timer(
+            self.idle_timeout, self._evict, args=(self._timer_token,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _cancel_timer(self):
+        # A timer that already fired may be blocked on the lock; bumping the
+        # token makes its _evict a no-op.
+        self._timer_token += 1
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _evict(self, token):
+        with self._lock:
+            if token != self._timer_token:
+                return
+            if self._active or self._expander is None or self._on_cpu:
+                return
+            self._timer = None
+            if self.offload == "cpu" and self._move_model("cpu"):
+                self._on_cpu = True
+                action = "moved to cpu"
+            else:
+                self._expander = None
+                action = "unloaded"
+            self.stats["unloads"] += 1
+        gc.collect()
+        _empty_cuda_cache()
+        print(
+            f"[prompt_expander] idle for {self.idle_timeout}s, {action}",
+            flush=True)
+
+    def _move_model(self, device):
+        model = getattr(self._expander, "model", None)
+        if model is None or not hasattr(model, "to"):
+            return False
+        self._expander.model = model.to(device)
+        return True
+
+
+def _empty_cuda_cache():
+    try:
+        import torch
+    except ImportError:
+        return
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
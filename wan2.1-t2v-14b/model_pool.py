@@ -0,0 +1,205 @@
+# Routing and GPU-memory-bounded residency for multiple T2V models.
+#
+# Kept free of torch/wan imports so the policy can be exercised with stub
+# loaders; the Gradio server injects the real loaders and memory probes.
+import gc
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class ModelSpec:
+    """
+    A model the pool can serve.
+
+    `loader` is a zero-argument callable returning the model. `memory_gb` is
+    the estimated resident size and is replaced by the measured size after
+    the first load when the pool has a memory probe. `sizes` lists the
+    "W*H" resolutions the model supports (None means any).
+    """
+
+    def __init__(self, name, loader, memory_gb, sizes=None):
+        self.name = name
+        self.loader = loader
+        self.memory_gb = memory_gb
+        self.sizes = tuple(sizes) if sizes is not None else None
+
+    def supports(self, size):
+        return self.sizes is None or size in self.sizes
+
+
+class ModelPool:
+    """
+    Routes requests to registered models and keeps them resident under an
+    LRU policy bounded by `budget_gb`.
+
+    A model in use is pinned and never evicted; if the requested model does
+    not fit until a pinned model is released, `acquire` waits for it. Loads
+    run without holding the pool lock, so requests for already resident
+    models are served while another model swaps in.
+
+    `measure` returns the currently allocated GPU memory in GB and `release`
+    frees cached allocator blocks after an eviction.
+    """
+
+    def __init__(self,
+                 budget_gb,
+                 draft_model=None,
+                 default_model=None,
+                 draft_max_area=832 * 480,
+                 measure=None,
+                 release=None):
+        self.budget_gb = budget_gb
+        self.draft_model = draft_model
+        self.default_model = default_model
+        self.draft_max_area = draft_max_area
+        self._measure = measure
+        self._release = release
+        self._specs = OrderedDict()
+        self._resident = OrderedDict()
+        self._loading = {}
+        self._pins = {}
+        self._cond = threading.Condition()
+        self.stats = {
+            "swap_in": 0,
+            "swap_out": 0,
+            "swap_in_s": [],
+            "swap_out_s": [],
+            "routed": {},
+        }
+
+    def register(self, spec):
+        if spec.name in self._specs:
+            raise ValueError(f"Model already registered: {spec.name}")
+        self._specs[spec.name] = spec
+        if self.default_model is None:
+            self.default_model = spec.name
+
+    @property
+    def models(self):
+        return list(self._specs)
+
+    @property
+    def resident(self):
+        with self._cond:
+            return list(self._resident)
+
+    def used_gb(self):
+        """Memory of resident models plus reservations of loading ones."""
+        return (sum(self._specs[name].memory_gb for name in self._resident) +
+                sum(self._loading.values()))
+
+    def route(self, size, model=None, draft=False):
+        """
+        Pick the model for a request.
+
+        An explicit `model` wins (and must support `size`). Otherwise drafts
+        and resolutions no larger than `draft_max_area` go to `draft_model`
+        when it supports `size`; everything else goes to `default_model`.
+        """
+        if model and model != "auto":
+            if model not in self._specs:
+                raise ValueError(f"Unknown model: {model}")
+            if not self._specs[model].supports(size):
+                raise ValueError(f"{model} does not support size {size}")
+            name = model
+        else:
+            name = self.default_model
+            draft_spec = self._specs.get(self.draft_model)
+            if draft_spec is not None and draft_spec.supports(size):
+                W, H = (int(v) for v in size.split("*"))
+                if draft or W * H <= self.draft_max_area:
+                    name = self.draft_model
+            if name is None or not self._specs[name].supports(size):
+                raise ValueError(f"No registered model supports size {size}")
+        with self._cond:
+            self.stats["routed"][name] = self.stats["routed"].get(name, 0) + 1
+        return name
+
+    @contextmanager
+    def acquire(self, name):
+        """Yield the resident model `name`, swapping it in if necessary."""
+        if name not in self._specs:
+            raise ValueError(f"Unknown model: {name}")
+        with self._cond:
+            model = self._ensure_resident(name)
+            self._pins[name] = self._pins.get(name, 0) + 1
+        try:
+            yield model
+        finally:
+            with self._cond:
+                self._pins[name] -= 1
+                if not self._pins[name]:
+                    del self._pins[name]
+                self._cond.notify_all()
+
+    def evict(self, name):
+        with self._cond:
+            if self._pins.get(name):
+                raise RuntimeError(f"Model in use: {name}")
+            if name in self._resident:
+                self._swap_out(name)
+
+    def _ensure_resident(self, name):
+        # Called with self._cond held; returns with it held.
+        spec = self._specs[name]
+        while True:
+            if name in self._resident:
+                self._resident.move_to_end(name)
+                return self._resident[name]
+            if name in self._loading:
+                self._cond.wait()
+                continue
+            if spec.memory_gb > self.budget_gb:
+                raise RuntimeError(
+                    f"{name} needs {spec.memory_gb:.1f}GB, "
+                    f"budget is {self.budget_gb:.1f}GB")
+            if self.used_gb() + spec.memory_gb <= self.budget_gb:
+                break
+            victim = next(
+                (n for n in self._resident if not self._pins.get(n)), None)
+            if victim is None:
+                self._cond.wait()
+            else:
+                self._swap_out(victim)
+
+        # Reserve the memory, then load outside the lock.
+        self._loading[name] = spec.memory_gb
+        self._cond.release()
+        try:
+            start = time.perf_counter()
+            before = self._measure() if self._measure else None
+            model = spec.loader()
+            if before is not None:
+                measured = self._measure() - before
+                if measured > 0:
+                    spec.memory_gb = measured
+            elapsed = time.perf_counter() - start
+        finally:
+            self._cond.acquire()
+            del self._loading[name]
+            self._cond.notify_all()
+
+        self._resident[name] = model
+        self.stats["swap_in"] += 1
+        self.stats["swap_in_s"].append(elapsed)
+        print(
+            f"[model_pool] swapped in {name} in {elapsed:.2f}s "
+            f"({self.used_gb():.1f}/{self.budget_gb:.1f}GB)",
+            flush=True)
+        return model
+
+    def _swap_out(self, name):
+        start = time.perf_counter()
+        del self._resident[name]
+        gc.collect()
+        if self._release:
+            self._release()
+        elapsed = time.perf_counter() - start
+        self.stats["swap_out"] += 1
+        self.stats["swap_out_s"].append(elapsed)
+        print(
+            f"[model_pool] swapped out {name} in {elapsed:.2f}s "
+            f"({self.used_gb():.1f}/{self.budget_gb:.1f}GB)",
+            flush=True)
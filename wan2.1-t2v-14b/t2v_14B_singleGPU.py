@@ -4,6 +4,7 @@ import os.path as osp
 import os
 import sys
 import warnings
+from contextlib import ExitStack, nullcontext
 
 import gradio as gr
 
@@ -12,13 +13,18 @@ warnings.filterwarnings('ignore')
 # Model
 sys.path.insert(0, os.path.sep.join(osp.realpath(__file__).split(os.path.sep)[:-2]))
 import wan
-from wan.configs import WAN_CONFIGS
+from wan.configs import SUPPORTED_SIZES, WAN_CONFIGS
 from wan.utils.prompt_extend import DashScopePromptExpander, QwenPromptExpander
 from wan.utils.utils import cache_video
 
+from lazy_prompt_expander import LazyPromptExpander
+from model_pool import ModelPool, ModelSpec
+from trace_profiler import TraceProfiler, instrument, span
+
 # Global Var
 prompt_expander = None
-wan_t2v = None
+model_pool = None
+profiler = None
 
 
 # Button Func
@@ -32,39 +38,73 @@ def prompt_enc(prompt, tar_lang):
 
 
 def t2v_generation(txt2vid_prompt, resolution, sd_steps, guide_scale,
-                   shift_scale, seed, n_prompt):
-    global wan_t2v
+                   shift_scale, seed, n_prompt, model_choice, draft,
+                   profile_request):
+    global model_pool
     # print(f"{txt2vid_prompt},{resolution},{sd_steps},{guide_scale},{shift_scale},{seed},{n_prompt}")
 
+    try:
+        model_name = model_pool.route(
+            resolution, model=model_choice, draft=draft)
+    except ValueError as e:
+        raise gr.Error(str(e))
+    print(f"Routing {resolution} (draft={draft}) to {model_name}", flush=True)
+
     W = int(resolution.split("*")[0])
     H = int(resolution.split("*")[1])
-    video = wan_t2v.generate(
-        txt2vid_prompt,
-        size=(W, H),
-        shift=shift_scale,
-        sampling_steps=sd_steps,
-        guide_scale=guide_scale,
-        n_prompt=n_prompt,
-        seed=seed,
-        offload_model=True)
-
-    cache_video(
-        tensor=video[None],
-        save_file="example.mp4",
-        fps=16,
-        nrow=1,
-        normalize=True,
-        value_range=(-1, 1))
+    job = nullcontext()
+    if profiler is not None:
+        job = profiler.job(
+            f"{model_name}_{resolution}",
+            force=profile_request,
+            prompt=txt2vid_prompt,
+            sampling_steps=sd_steps)
+    with job as trace:
+        with model_pool.acquire(model_name) as wan_t2v, ExitStack() as stack:
+            # Only this request's own trace instruments the shared model.
+            if trace is not None:
+                stack.enter_context(
+                    instrument(wan_t2v, "text_encoder", "prompt_encode"))
+                stack.enter_context(
+                    instrument(wan_t2v, "model", "denoise_step", 2))
+                stack.enter_context(
+                    instrument(wan_t2v.vae, "decode", "vae_decode"))
+            video = wan_t2v.generate(
+                txt2vid_prompt,
+                size=(W, H),
+                shift=shift_scale,
+                sampling_steps=sd_steps,
+                guide_scale=guide_scale,
+                n_prompt=n_prompt,
+                seed=seed,
+                # Pooled models stay on the GPU between requests; eviction is
+                # left to the pool.
+                offload_model=False)
+
+        with span("cache_video", save_file="example.mp4"):
+            cache_video(
+                tensor=video[None],
+                save_file="example.mp4",
+                fps=16,
+                nrow=1,
+                normalize=True,
+                value_range=(-1, 1))
 
     return "example.mp4"
 
 
+def arm_profiler(jobs):
+    global profiler
+    pending = profiler.arm(jobs or 0)
+    return f"Tracing the next {pending} job(s)", profiler.traces()
+
+
 # Interface
 def gradio_interface():
     with gr.Blocks() as demo:
         gr.Markdown("""
                     <div style="text-align: center; font-size: 32px; font-weight: bold; margin-bottom: 20px;">
-                        Wan2.1 (T2V-14B)
+                        Wan2.1 (T2V)
                     </div>
                     <div style="text-align: center; font-size: 16px; font-weight: normal; margin-bottom: 20px;">
                         Wan: Open and Advanced Large-Scale Video Generative Models.
@@ -84,6 +124,14 @@ def gradio_interface():
                 run_p_button = gr.Button(value="Prompt Enhance")
 
                 with gr.Accordion("Advanced Options", open=True):
+                    with gr.Row():
+                        model_choice = gr.Dropdown(
+                            label="Model",
+                            choices=["auto"] + model_pool.models,
+                            value="auto")
+                        draft = gr.Checkbox(
+                            label="Draft (route to the small model)",
+                            value=False)
                     resolution = gr.Dropdown(
                         label='Resolution(Width*Height)',
                         choices=[
@@ -124,8 +172,23 @@ def gradio_interface():
                         placeholder="Describe the negative prompt you want to add"
                     )
 
+                profile_request = gr.Checkbox(
+                    label="Profile this request",
+                    value=False,
+                    visible=profiler is not None)
                 run_t2v_button = gr.Button("Generate Video")
 
+                with gr.Accordion(
+                        "Profiling", open=False,
+                        visible=profiler is not None):
+                    with gr.Row():
+                        profile_jobs = gr.Number(
+                            label="Trace the next N jobs", value=1, precision=0)
+                        run_profile_button = gr.Button("Arm profiler")
+                    profile_status = gr.Textbox(
+                        label="Status", interactive=False)
+                    trace_index = gr.JSON(label="Captured traces")
+
             with gr.Column():
                 result_gallery = gr.Video(
                     label='Generated Video', interactive=False, height=600)
@@ -139,11 +202,19 @@ def gradio_interface():
             fn=t2v_generation,
             inputs=[
                 txt2vid_prompt, resolution, sd_steps, guide_scale, shift_scale,
-                seed, n_prompt
+                seed, n_prompt, model_choice, draft, profile_request
             ],
             outputs=[result_gallery],
         )
 
+        if profiler is not None:
+            run_profile_button.click(
+                fn=arm_profiler,
+                inputs=[profile_jobs],
+                outputs=[profile_status, trace_index],
+                api_name="profile",
+            )
+
     return demo
 
 
@@ -156,6 +227,49 @@ def _parse_args():
         type=str,
         default="cache",
         help="The path to the checkpoint directory.")
+    parser.add_argument(
+        "--ckpt_dir_1_3B",
+        type=str,
+        default=None,
+        help="The path to the T2V-1.3B checkpoint directory. When set, the "
+        "1.3B model is served alongside 14B and used for drafts.")
+    parser.add_argument(
+        "--gpu_memory_budget",
+        type=float,
+        default=None,
+        help="GPU memory in GB that resident models may occupy. Defaults "
+        "to the free memory of device 0 minus --gpu_memory_headroom.")
+    parser.add_argument(
+        "--gpu_memory_headroom",
+        type=float,
+        default=20,
+        help="GPU memory in GB kept free for activations, VAE decode and a "
+        "prompt extend model on the same device when the budget is derived "
+        "from free memory.")
+    parser.add_argument(
+        "--draft_max_area",
+        type=int,
+        default=832 * 480,
+        help="Requests with W*H at or below this go to the 1.3B model when "
+        "the model choice is 'auto'.")
+    parser.add_argument(
+        "--trace_dir",
+        type=str,
+        default=None,
+        help="Directory for Chrome/Perfetto traces of profiled requests. "
+        "Profiling is disabled unless this is set.")
+    parser.add_argument(
+        "--profile_jobs",
+        type=int,
+        default=0,
+        help="Number of generation requests to trace from startup.")
+    parser.add_argument(
+        "--trace_torch",
+        action="store_true",
+        default=False,
+        help="Also run torch.profiler (CPU and CUDA ops) for traced requests "
+        "and write its Kineto trace next to each trace. Memory heavy for "
+        "full-length generations.")
     parser.add_argument(
         "--prompt_extend_method",
         type=str,
@@ -167,6 +281,24 @@ def _parse_args():
         type=str,
         default=None,
         help="The prompt extend model to use.")
+    parser.add_argument(
+        "--prompt_extend_device",
+        type=str,
+        default="0",
+        help="The device to run the local_qwen prompt extend model on, "
+        "e.g. '0', 'cuda:1' or 'cpu'.")
+    parser.add_argument(
+        "--prompt_extend_idle_timeout",
+        type=float,
+        default=300,
+        help="Seconds without a prompt enhance request before the prompt "
+        "extend model is released. 0 keeps it loaded.")
+    parser.add_argument(
+        "--prompt_extend_offload",
+        type=str,
+        default="unload",
+        choices=["unload", "cpu"],
+        help="How to release an idle prompt extend model.")
 
     args = parser.parse_args()
 
@@ -176,30 +308,78 @@ def _parse_args():
 if __name__ == '__main__':
     args = _parse_args()
 
-    print("Step1: Init prompt_expander...", end='', flush=True)
+    print("Step1: Init prompt_expander (lazy)...", end='', flush=True)
+    device = args.prompt_extend_device
+    if device.isdigit():
+        device = int(device)
     if args.prompt_extend_method == "dashscope":
-        prompt_expander = DashScopePromptExpander(
+        factory = lambda: DashScopePromptExpander(
             model_name=args.prompt_extend_model, is_vl=False)
     elif args.prompt_extend_method == "local_qwen":
-        prompt_expander = QwenPromptExpander(
-            model_name=args.prompt_extend_model, is_vl=False, device=0)
+        factory = lambda: QwenPromptExpander(
+            model_name=args.prompt_extend_model, is_vl=False, device=device)
     else:
         raise NotImplementedError(
             f"Unsupport prompt_extend_method: {args.prompt_extend_method}")
+    prompt_expander = LazyPromptExpander(
+        factory,
+        device=device,
+        idle_timeout=args.prompt_extend_idle_timeout,
+        offload=args.prompt_extend_offload)
     print("done", flush=True)
 
-    print("Step2: Init 14B t2v model...", end='', flush=True)
-    cfg = WAN_CONFIGS['t2v-14B']
-    wan_t2v = wan.WanT2V(
-        config=cfg,
-        checkpoint_dir=args.ckpt_dir,
-        device_id=0,
-        rank=0,
-        t5_fsdp=False,
-        dit_fsdp=False,
-        use_usp=False,
-    )
+    print("Step2: Init t2v model pool...", end='', flush=True)
+    import torch
+
+    GB = 1024**3
+    budget = args.gpu_memory_budget
+    if budget is None:
+        free, _ = torch.cuda.mem_get_info(0)
+        budget = free / GB - args.gpu_memory_headroom
+
+    def load_t2v(task, ckpt_dir):
+
+        def load():
+            model = wan.WanT2V(
+                config=WAN_CONFIGS[task],
+                checkpoint_dir=ckpt_dir,
+                device_id=0,
+                rank=0,
+                t5_fsdp=False,
+                dit_fsdp=False,
+                use_usp=False,
+            )
+            # WanT2V keeps T5 on the CPU until generate(); move it now so the
+            # pool measures the full resident size.
+            model.text_encoder.model.to(model.device)
+            return model
+
+        return load
+
+    model_pool = ModelPool(
+        budget_gb=budget,
+        draft_model='t2v-1.3B' if args.ckpt_dir_1_3B else None,
+        default_model='t2v-14B',
+        draft_max_area=args.draft_max_area,
+        measure=lambda: torch.cuda.memory_allocated(0) / GB,
+        release=torch.cuda.empty_cache)
+    model_pool.register(
+        ModelSpec('t2v-14B', load_t2v('t2v-14B', args.ckpt_dir),
+                  memory_gb=40))
+    if args.ckpt_dir_1_3B:
+        model_pool.register(
+            ModelSpec(
+                't2v-1.3B',
+                load_t2v('t2v-1.3B', args.ckpt_dir_1_3B),
+                memory_gb=14,
+                sizes=SUPPORTED_SIZES['t2v-1.3B']))
+    with model_pool.acquire('t2v-14B'):
+        pass
     print("done", flush=True)
 
+    if args.trace_dir:
+        profiler = TraceProfiler(args.trace_dir, use_torch=args.trace_torch)
+        profiler.arm(args.profile_jobs)
+
     demo = gradio_interface()
     demo.launch(server_name="0.0.0.0", share=False, server_port=8080)
@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+from lazy_prompt_expander import LazyPromptExpander
+
+
+class StubModel:
+
+    def __init__(self):
+        self.devices = []
+
+    def to(self, device):
+        self.devices.append(device)
+        return self
+
+
+class StubExpander:
+
+    def __init__(self):
+        self.model = StubModel()
+
+    def __call__(self, prompt, tar_lang="zh"):
+        return f"{prompt}:{tar_lang}"
+
+
+def make_factory(delay=0.0):
+    built = []
+
+    def factory():
+        time.sleep(delay)
+        expander = StubExpander()
+        built.append(expander)
+        return expander
+
+    return factory, built
+
+
+def test_concurrent_first_use_shares_one_load():
+    factory, built = make_factory(delay=0.2)
+    expander = LazyPromptExpander(factory, idle_timeout=0)
+    results = []
+    workers = [
+        threading.Thread(target=lambda i=i: results.append(expander(f"p{i}")))
+        for i in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=5)
+    assert sorted(results) == [f"p{i}:zh" for i in range(4)]
+    assert len(built) == 1
+    assert expander.stats["loads"] == 1
+    assert expander.stats["cold_requests"] == 4
+
+
+def test_idle_unload_then_reload():
+    factory, built = make_factory()
+    expander = LazyPromptExpander(factory, idle_timeout=0.1)
+    assert expander("a", tar_lang="en") == "a:en"
+    time.sleep(0.3)
+    assert expander._expander is None
+    assert expander.stats["unloads"] == 1
+    assert expander("b") == "b:zh"
+    assert len(built) == 2
+    assert expander.stats["loads"] == 2
+    assert expander.stats["restores"] == 0
+
+
+def test_cpu_offload_and_restore():
+    factory, built = make_factory()
+    expander = LazyPromptExpander(
+        factory, device="cuda:1", idle_timeout=0.1, offload="cpu")
+    expander("a")
+    time.sleep(0.3)
+    assert expander._on_cpu
+    assert built[0].model.devices == ["cpu"]
+    expander("b")
+    assert not expander._on_cpu
+    assert built[0].model.devices == ["cpu", "cuda:1"]
+    assert len(built) == 1
+    assert expander.stats["loads"] == 1
+    assert expander.stats["restores"] == 1
+    assert expander.stats["unloads"] == 1
+
+
+def test_stale_timer_does_not_evict():
+    factory, _ = make_factory()
+    expander = LazyPromptExpander(factory, idle_timeout=60)
+    expander("a")
+    stale_token = expander._timer_token
+    # A request arrives while the fired timer is still waiting on the lock.
+    with expander._lock:
+        fired = threading.Thread(target=expander._evict, args=(stale_token,))
+        fired.start()
+        expander._cancel_timer()
+    fired.join(timeout=5)
+    assert expander._expander is not None
+    assert expander.stats["unloads"] == 0
+    expander._cancel_timer()
+
+
+def test_factory_failure_leaves_state_clean():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("no weights")
+        return StubExpander()
+
+    expander = LazyPromptExpander(factory, idle_timeout=0)
+    with pytest.raises(RuntimeError):
+        expander("a")
+    assert expander._pending is None
+    assert expander._active == 0
+    assert expander._expander is None
+    assert expander("b") == "b:zh"
+    assert expander.stats["loads"] == 1
@@ -0,0 +1,121 @@
+import threading
+
+import pytest
+
+from model_pool import ModelPool, ModelSpec
+
+SMALL_SIZES = ("832*480", "480*832")
+
+
+def make_pool(budget_gb=50, big_gb=40, small_gb=12):
+    loads = []
+
+    def loader(name):
+
+        def load():
+            loads.append(name)
+            return f"model:{name}"
+
+        return load
+
+    pool = ModelPool(
+        budget_gb=budget_gb, draft_model="t2v-1.3B", default_model="t2v-14B")
+    pool.register(ModelSpec("t2v-14B", loader("t2v-14B"), big_gb))
+    pool.register(
+        ModelSpec(
+            "t2v-1.3B", loader("t2v-1.3B"), small_gb, sizes=SMALL_SIZES))
+    return pool, loads
+
+
+def test_route_explicit_auto_and_draft():
+    pool, _ = make_pool()
+    assert pool.route("832*480", model="t2v-14B") == "t2v-14B"
+    assert pool.route("832*480", model="auto") == "t2v-1.3B"
+    assert pool.route("1280*720") == "t2v-14B"
+    assert pool.route("480*832", draft=True) == "t2v-1.3B"
+    assert pool.stats["routed"] == {"t2v-14B": 2, "t2v-1.3B": 2}
+
+
+def test_route_unsupported_size_falls_back_to_default():
+    pool, _ = make_pool()
+    assert pool.route("1280*720", draft=True) == "t2v-14B"
+    assert pool.route("624*624") == "t2v-14B"
+    with pytest.raises(ValueError):
+        pool.route("1280*720", model="t2v-1.3B")
+    with pytest.raises(ValueError):
+        pool.route("832*480", model="t2v-missing")
+
+
+def test_lru_eviction_under_budget():
+    pool, loads = make_pool(budget_gb=60, big_gb=30, small_gb=20)
+    pool.register(ModelSpec("extra", lambda: "model:extra", 20))
+    with pool.acquire("t2v-14B"):
+        pass
+    with pool.acquire("t2v-1.3B"):
+        pass
+    with pool.acquire("t2v-14B") as model:
+        assert model == "model:t2v-14B"
+    # t2v-1.3B is now least recently used and makes room for "extra".
+    with pool.acquire("extra"):
+        pass
+    assert pool.resident == ["t2v-14B", "extra"]
+    assert loads == ["t2v-14B", "t2v-1.3B"]
+    assert pool.stats["swap_in"] == 3
+    assert pool.stats["swap_out"] == 1
+    assert len(pool.stats["swap_in_s"]) == 3
+    assert len(pool.stats["swap_out_s"]) == 1
+
+
+def test_pinned_model_is_not_evicted():
+    pool, _ = make_pool(budget_gb=50)
+    acquired = threading.Event()
+
+    def use_small():
+        with pool.acquire("t2v-1.3B"):
+            acquired.set()
+
+    with pool.acquire("t2v-14B"):
+        worker = threading.Thread(target=use_small)
+        worker.start()
+        assert not acquired.wait(0.2)
+        assert pool.resident == ["t2v-14B"]
+    worker.join(timeout=5)
+    assert acquired.is_set()
+    assert pool.resident == ["t2v-1.3B"]
+    assert pool.stats["swap_out"] == 1
+    with pytest.raises(RuntimeError):
+        with pool.acquire("t2v-1.3B"):
+            pool.evict("t2v-1.3B")
+
+
+def test_resident_model_served_while_another_loads():
+    loading = threading.Event()
+    release = threading.Event()
+
+    def slow_loader():
+        loading.set()
+        release.wait(5)
+        return "model:slow"
+
+    pool, _ = make_pool(budget_gb=80)
+    pool.register(ModelSpec("slow", slow_loader, 10))
+    with pool.acquire("t2v-14B"):
+        pass
+    results = []
+
+    def use_slow():
+        with pool.acquire("slow") as model:
+            results.append(model)
+
+    workers = [threading.Thread(target=use_slow) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    assert loading.wait(5)
+    with pool.acquire("t2v-14B") as model:
+        assert model == "model:t2v-14B"
+    release.set()
+    for worker in workers:
+        worker.join(timeout=5)
+    assert results == ["model:slow", "model:slow"]
+    assert pool.stats["swap_in"] == 2
+    assert pool._pins == {}
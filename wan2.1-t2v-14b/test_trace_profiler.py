@@ -0,0 +1,142 @@
+import json
+
+import pytest
+
+import trace_profiler
+from trace_profiler import TraceProfiler, counter, instrument, span
+
+
+class StubVAE:
+
+    def decode(self, latents):
+        return latents
+
+
+class StubTextEncoder:
+
+    def __init__(self):
+        self.model = "t5"
+
+    def __call__(self, prompt):
+        return [prompt]
+
+
+class StubPipeline:
+    """Calls its parts the way WanT2V.generate does."""
+
+    def __init__(self):
+        self.text_encoder = StubTextEncoder()
+        self.model = lambda latents, context: latents
+        self.vae = StubVAE()
+
+    def generate(self, prompt, steps=3):
+        context = self.text_encoder(prompt)
+        latents = 0
+        for _ in range(steps):
+            self.model(latents, context)
+            self.model(latents, [])
+        return self.vae.decode(latents)
+
+
+def run_job(profiler, pipe, name="job", force=False):
+    with profiler.job(name, force=force) as trace:
+        if trace is None:
+            return pipe.generate("a cat"), None
+        with instrument(pipe, "text_encoder", "prompt_encode"), \
+                instrument(pipe, "model", "denoise_step", 2), \
+                instrument(pipe.vae, "decode", "vae_decode"):
+            video = pipe.generate("a cat")
+        with span("cache_video"):
+            counter("iterations_per_second", value=1.5)
+        return video, trace
+
+
+def load_events(profiler, entry):
+    with open(f"{profiler.output_dir}/{entry['file']}") as f:
+        return json.load(f)["traceEvents"]
+
+
+@pytest.fixture
+def profiler(tmp_path):
+    return TraceProfiler(str(tmp_path), sample_interval=0.001)
+
+
+def test_idle_profiler_returns_noops(profiler):
+    pipe = StubPipeline()
+    assert span("x") is trace_profiler._NULL
+    assert counter("x", value=1) is None
+    assert instrument(pipe, "model", "denoise_step") is trace_profiler._NULL
+    assert run_job(profiler, pipe) == (0, None)
+    assert profiler.traces() == []
+
+
+def test_arm_traces_exactly_n_jobs_and_force_keeps_slots(profiler):
+    pipe = StubPipeline()
+    assert profiler.arm(2) == 2
+    _, forced = run_job(profiler, pipe, "forced", force=True)
+    assert forced is not None
+    assert profiler.pending == 2
+    traced = [run_job(profiler, pipe, f"job{i}")[1] for i in range(3)]
+    assert [t is not None for t in traced] == [True, True, False]
+    assert profiler.pending == 0
+    assert [e["job"] for e in profiler.traces()] == ["forced", "job0", "job1"]
+    assert trace_profiler._active is None
+
+
+def test_trace_contents_and_instrument_restore(profiler):
+    pipe = StubPipeline()
+    original_model = pipe.model
+    profiler.arm(1)
+    run_job(profiler, pipe)
+    assert pipe.model is original_model
+    assert "decode" not in vars(pipe.vae)
+    assert trace_profiler._patches == {}
+
+    (entry,) = profiler.traces()
+    events = load_events(profiler, entry)
+    steps = [(e["ph"], e.get("args", {}).get("step"))
+             for e in events
+             if e["name"] == "denoise_step"]
+    assert steps == [("B", 0), ("E", None), ("B", 1), ("E", None), ("B", 2),
+                     ("E", None)]
+    names = {(e["name"], e["ph"]) for e in events}
+    assert {("prompt_encode", "X"), ("vae_decode", "X"),
+            ("cache_video", "X"), ("iterations_per_second", "C")} <= names
+
+
+def test_job_exception_clears_active(profiler):
+    profiler.arm(1)
+    with pytest.raises(ValueError):
+        with profiler.job("boom"):
+            raise ValueError("generation failed")
+    assert trace_profiler._active is None
+    assert len(profiler.traces()) == 1
+
+
+@pytest.mark.parametrize("method", ["start", "stop"])
+def test_failing_trace_start_or_stop_does_not_fail_job(
+        profiler, monkeypatch, method):
+
+    def fail(self):
+        raise RuntimeError("CUPTI error")
+
+    monkeypatch.setattr(trace_profiler._Trace, method, fail)
+    profiler.arm(1)
+    video, _ = run_job(profiler, StubPipeline(), force=True)
+    assert video == 0
+    assert trace_profiler._active is None
+    monkeypatch.undo()
+    _, trace = run_job(profiler, StubPipeline())
+    assert trace is not None
+
+
+def test_failing_write_does_not_fail_job(profiler, monkeypatch):
+
+    def fail(self, trace):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(TraceProfiler, "_write", fail)
+    profiler.arm(1)
+    video, trace = run_job(profiler, StubPipeline())
+    assert video == 0 and trace is not None
+    assert trace_profiler._active is None
@@ -0,0 +1,406 @@
+# Opt-in Chrome/Perfetto trace capture for generation jobs.
+#
+# Nothing is recorded until a TraceProfiler is armed for the next N jobs (or a
+# job is forced). While idle, `span`, `counter` and `instrument` return shared
+# no-op objects, so instrumented code pays a single global lookup.
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+_NULL = nullcontext()
+_SAMPLER_TID = 0
+
+# The trace being recorded, if any. Only one job is traced at a time.
+_active = None
+_active_lock = threading.Lock()
+
+# (id(obj), attr) -> [own, original, depth] for attributes wrapped by
+# `instrument`, so nested or overlapping wraps restore the original once.
+_patches = {}
+_patches_lock = threading.Lock()
+
+
+def span(name, **args):
+    """Time a region in the active trace."""
+    trace = _active
+    if trace is None:
+        return _NULL
+    return trace.span(name, args)
+
+
+def counter(name, **values):
+    """Record counter values (e.g. it/s) in the active trace."""
+    trace = _active
+    if trace is not None:
+        trace.counter(name, values)
+
+
+def instrument(obj, attr, name, calls_per_span=1):
+    """
+    Wrap the callable `obj.<attr>` so each call is recorded as a span named
+    `name` for the duration of the `with` block.
+
+    With `calls_per_span=n`, every n consecutive calls are grouped into one
+    span, e.g. the conditional and unconditional DiT passes of a denoising
+    step. Only calls made on the traced job's thread are recorded, so other
+    requests sharing `obj` are not attributed to the trace.
+    """
+    if _active is None:
+        return _NULL
+    return _patched(obj, attr, name, calls_per_span)
+
+
+@contextmanager
+def _patched(obj, attr, name, calls_per_span):
+    key = (id(obj), attr)
+    with _patches_lock:
+        entry = _patches.get(key)
+        if entry is None:
+            own = attr in vars(obj)
+            original = getattr(obj, attr)
+            entry = _patches[key] = [own, original, 0]
+            setattr(obj, attr, _Instrumented(original, name, calls_per_span))
+        entry[2] += 1
+    try:
+        yield getattr(obj, attr)
+    finally:
+        with _patches_lock:
+            entry[2] -= 1
+            if not entry[2]:
+                del _patches[key]
+                own, original, _ = entry
+                if own:
+                    setattr(obj, attr, original)
+                else:
+                    delattr(obj, attr)
+
+
+class _Instrumented:
+
+    def __init__(self, target, name, calls_per_span):
+        self._target = target
+        self._name = name
+        self._calls_per_span = calls_per_span
+        self._calls = 0
+        self._trace = None
+
+    def __getattr__(self, item):
+        return getattr(self._target, item)
+
+    def __call__(self, *args, **kwargs):
+        trace = _active
+        if trace is None or threading.get_ident() != trace.thread_id:
+            return self._target(*args, **kwargs)
+        if trace is not self._trace:
+            self._trace, self._calls = trace, 0
+        if self._calls_per_span == 1:
+            with trace.span(self._name, {"call": self._calls}):
+                self._calls += 1
+                return self._target(*args, **kwargs)
+
+        index, self._calls = self._calls, self._calls + 1
+        position = index % self._calls_per_span
+        if position == 0:
+            trace.begin(self._name,
+                        {"step": index // self._calls_per_span})
+        try:
+            return self._target(*args, **kwargs)
+        finally:
+            if position == self._calls_per_span - 1:
+                trace.end(self._name)
+
+
+class _Trace:
+    """Events of a single job: spans and Python stack samples."""
+
+    def __init__(self, name, args, sample_interval, use_torch):
+        self.name = name
+        self.args = args
+        self.pid = os.getpid()
+        self.events = []
+        self._lock = threading.Lock()
+        self.thread_id = threading.get_ident()
+        self._sample_interval = sample_interval
+        self._use_torch = use_torch
+        self._torch = None
+        self._torch_result = None
+        self.torch_start = 0.0
+        self._stop = threading.Event()
+        self._sampler = None
+        self.started = time.time()
+        self.duration = 0.0
+        self._t0 = time.perf_counter_ns()
+
+    def now(self):
+        return (time.perf_counter_ns() - self._t0) / 1000
+
+    def emit(self, event):
+        event.setdefault("pid", self.pid)
+        with self._lock:
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name, args):
+        record = self._record_function(name)
+        start = self.now()
+        try:
+            with record:
+                yield
+        finally:
+            self.emit({
+                "name": name,
+                "ph": "X",
+                "ts": start,
+                "dur": self.now() - start,
+                "tid": threading.get_ident(),
+                "args": args,
+            })
+
+    def begin(self, name, args):
+        self.emit({
+            "name": name,
+            "ph": "B",
+            "ts": self.now(),
+            "tid": threading.get_ident(),
+            "args": args,
+        })
+
+    def end(self, name):
+        self.emit({
+            "name": name,
+            "ph": "E",
+            "ts": self.now(),
+            "tid": threading.get_ident(),
+        })
+
+    def counter(self, name, values):
+        self.emit({"name": name, "ph": "C", "ts": self.now(), "args": values})
+
+    def start(self):
+        self._metadata("process_name", self.pid, None, f"job: {self.name}")
+        self._metadata("thread_name", self.pid, _SAMPLER_TID,
+                       "python samples")
+        self._metadata("thread_name", self.pid, self.thread_id, "job")
+        if self._use_torch:
+            self._start_torch()
+        if self._sample_interval:
+            self._sampler = threading.Thread(
+                target=self._sample, name="trace_sampler", daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        self.duration = self.now() / 1e6
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        if self._torch is not None:
+            self._stop_torch()
+
+    def _metadata(self, kind, pid, tid, name):
+        event = {"name": kind, "ph": "M", "pid": pid, "args": {"name": name}}
+        if tid is not None:
+            event["tid"] = tid
+        self.emit(event)
+
+    def _record_function(self, name):
+        if self._torch is None:
+            return _NULL
+        from torch.profiler import record_function
+        return record_function(name)
+
+    def _sample(self):
+        # Consecutive samples sharing a stack prefix are merged into one
+        # slice per frame, giving a flame chart on the sampler track.
+        opened = []
+        while not self._stop.wait(self._sample_interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} "
+                             f"({os.path.basename(code.co_filename)}:"
+                             f"{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.reverse()
+            now = self.now()
+            depth = 0
+            while (depth < len(opened) and depth < len(stack) and
+                   opened[depth][0] == stack[depth]):
+                depth += 1
+            self._close_samples(opened[depth:], now)
+            opened = opened[:depth] + [(key, now) for key in stack[depth:]]
+        self._close_samples(opened, self.now())
+
+    def _close_samples(self, frames, now):
+        for key, start in reversed(frames):
+            self.emit({
+                "name": key,
+                "cat": "sample",
+                "ph": "X",
+                "ts": start,
+                "dur": now - start,
+                "tid": _SAMPLER_TID,
+            })
+
+    def _start_torch(self):
+        try:
+            import torch
+            from torch.profiler import ProfilerActivity, profile
+        except ImportError:
+            return
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        prof = profile(activities=activities)
+        prof.__enter__()
+        self._torch = prof
+        self.torch_start = self.now()
+
+    def _stop_torch(self):
+        prof, self._torch = self._torch, None
+        prof.__exit__(None, None, None)
+        self._torch_result = prof
+
+    def export_torch(self, path):
+        """Write the torch profiler's Kineto trace to `path`, if captured."""
+        prof, self._torch_result = self._torch_result, None
+        if prof is None:
+            return False
+        prof.export_chrome_trace(path)
+        return True
+
+
+class TraceProfiler:
+    """
+    Captures Chrome/Perfetto traces of the next N jobs into `output_dir`.
+
+    Each trace is written as `<timestamp>_<name>.json` and listed in
+    `index.json`, newest last. Open the files in ui.perfetto.dev or
+    chrome://tracing.
+
+    With `use_torch`, torch.profiler also records the job and its Kineto
+    trace is exported next to ours as `<timestamp>_<name>.torch.json`. It
+    keeps its own clock; `torch_start_us` in our trace's otherData marks
+    when it started.
+    """
+
+    def __init__(self, output_dir, sample_interval=0.005, use_torch=False):
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.use_torch = use_torch
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def arm(self, jobs=1):
+        """Trace the next `jobs` jobs. Returns the number still pending."""
+        with self._lock:
+            self._pending += max(int(jobs), 0)
+            return self._pending
+
+    @contextmanager
+    def job(self, name, force=False, **args):
+        """
+        Trace the enclosed job if armed (or `force`), yielding the trace or
+        None. Jobs starting while another is traced are not captured.
+        Profiler failures are logged and never fail the job itself.
+        """
+        global _active
+        trace = None
+        with _active_lock, self._lock:
+            if _active is None and (force or self._pending):
+                if not force:
+                    self._pending -= 1
+                trace = _Trace(name, args, self.sample_interval,
+                               self.use_torch)
+                _active = trace
+        if trace is None:
+            yield None
+            return
+
+        try:
+            trace.start()
+        except Exception as e:
+            print(f"[trace_profiler] failed to start trace {name}: {e!r}",
+                  flush=True)
+            self._finish(trace, write=False)
+            yield None
+            return
+        try:
+            yield trace
+        finally:
+            self._finish(trace)
+
+    def _finish(self, trace, write=True):
+        global _active
+        try:
+            trace.stop()
+        except Exception as e:
+            print(f"[trace_profiler] failed to stop trace {trace.name}: {e!r}",
+                  flush=True)
+        finally:
+            with _active_lock:
+                _active = None
+        if not write:
+            return
+        try:
+            path = self._write(trace)
+        except Exception as e:
+            print(f"[trace_profiler] failed to write trace {trace.name}: "
+                  f"{e!r}",
+                  flush=True)
+        else:
+            print(f"[trace_profiler] wrote {path}", flush=True)
+
+    def traces(self):
+        """Return the captured-traces index."""
+        path = os.path.join(self.output_dir, "index.json")
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return json.load(f)
+
+    def _write(self, trace):
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(trace.started))
+        safe = "".join(c if c.isalnum() or c in "-." else "_"
+                       for c in trace.name)
+        filename = f"{stamp}_{safe}.json"
+        path = os.path.join(self.output_dir, filename)
+        torch_file = f"{stamp}_{safe}.torch.json"
+        if not trace.export_torch(os.path.join(self.output_dir, torch_file)):
+            torch_file = None
+        other = {"job": trace.name}
+        if torch_file:
+            other["torch_file"] = torch_file
+            other["torch_start_us"] = trace.torch_start
+        other.update({k: str(v) for k, v in trace.args.items()})
+        with open(path, "w") as f:
+            json.dump({
+                "traceEvents": trace.events,
+                "displayTimeUnit": "ms",
+                "otherData": other,
+            }, f)
+
+        with self._lock:
+            index = self.traces()
+            index.append({
+                "file": filename,
+                "torch_file": torch_file,
+                "job": trace.name,
+                "started": time.strftime("%Y-%m-%d %H:%M:%S",
+                                         time.localtime(trace.started)),
+                "duration_s": round(trace.duration, 3),
+                "args": {k: str(v) for k, v in trace.args.items()},
+            })
+            tmp = os.path.join(self.output_dir, "index.json.tmp")
+            with open(tmp, "w") as f:
+                json.dump(index, f, indent=2)
+            os.replace(tmp, os.path.join(self.output_dir, "index.json"))
+        return path